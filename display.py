@@ -6,12 +6,21 @@ import importlib
 import logging
 from abc import ABC, abstractmethod
 import threading
+import concurrent.futures
+import queue
 import shutil
 import json
+import hashlib
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import configparser
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
 from io import BytesIO
-from PIL import Image, ImageEnhance, ImageDraw, ImageFont, ImageColor # aka pillow
+from PIL import Image, ImageEnhance, ImageStat, ImageDraw, ImageFont, ImageColor # aka pillow
 from pathlib import Path
 from roonapi import RoonApi, RoonDiscovery #, RoonApiWebSocket
 
@@ -43,23 +52,122 @@ else:
 
 cfgpath = os.path.join(os.path.dirname(os.path.realpath(this_script)), 'roon.cfg')
 
+# Number of positioned (rotated, scaled, padded) images kept per viewer
+POSITION_CACHE_SIZE = 4
+
+# Seconds an e-ink update waits for newer requests before rendering
+UPDATE_DEBOUNCE = 0.5
+
+# Number of decoded album art images kept in memory
+IMAGE_CACHE_SIZE = 8
+
+# (connect, read) timeouts in seconds for album art downloads
+DOWNLOAD_TIMEOUT = (3.05, 10)
+
+# Zone events waiting to be processed; the oldest is dropped when full
+ZONE_QUEUE_SIZE = 8
+
+# Roon server discovery polling interval bounds, in seconds, and how many
+# fruitless polls between warnings that no server has been found
+DISCOVERY_BACKOFF_MIN = 0.5
+DISCOVERY_BACKOFF_MAX = 5
+DISCOVERY_WARN_POLLS  = 24
+
+# File name for the album art with a given image key (space-cleaner.sh
+# matches the same pattern)
+ALBUM_ART_FMT = "album_art_{}.jpg".format
+
+# Formats Roon serves album art in, so PIL doesn't try every other plugin
+IMAGE_FORMATS = ("JPEG", "PNG")
+
+# Transpose operation for each supported rotation setting
+ROTATIONS = {
+    0  : None,
+    90 : Image.ROTATE_90,
+    180: Image.ROTATE_180,
+    270: Image.ROTATE_270,
+}
+
+# Last image key written or read, so the file is only read once per process
+current_image_key = None
+
 def setCurrentImageKey(key):
+    global current_image_key
     path = getSavedImageDir() / "current_key"
-    path.write_text(key)
+    writeTextAtomic(path, key)
+    current_image_key = key
     return None
 
 def getCurrentImageKey():
-    path = getSavedImageDir() / "current_key"
-    if path.exists():
-        return path.read_text().strip()
-    return None
+    global current_image_key
+    if current_image_key is None:
+        path = getSavedImageDir() / "current_key"
+        try:
+            current_image_key = path.read_text().strip()
+        except FileNotFoundError:
+            return None
+    return current_image_key
 
+# The directories are fixed for the life of the process, and resolving the
+# script's realpath costs a syscall per path component, so only do it once
+@lru_cache(maxsize=None)
 def getSavedImageDir():
     return getRootDir() / "album_art"
 
+@lru_cache(maxsize=None)
 def getRootDir():
     return Path(os.path.dirname(os.path.dirname(os.path.realpath(this_script))))
 
+def getTempPath(path):
+    """Sibling of path to write to before atomically replacing path"""
+    return path.with_name(path.name + ".tmp")
+
+def writeTextAtomic(path, text):
+    """Write text to path so a crash or power cut never leaves it truncated"""
+    tmp_path = getTempPath(path)
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+
+def putLatest(q, item):
+    """Put item on a bounded queue, dropping the oldest entries to make room"""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+def openImage(source, size):
+    """Open album art, letting the JPEG decoder downscale towards size x size.
+    draft() only reduces by powers of two, so the result is never smaller"""
+    img = Image.open(source, formats=IMAGE_FORMATS)
+    img.draft('RGB', (size, size))
+    return img
+
+@lru_cache(maxsize=64)
+def getColourMatrix(colour, contrast, brightness):
+    """RGB matrix coefficients equivalent to the Color, Contrast and Brightness
+    enhancers applied in that order, excluding the contrast offset"""
+    # Colour blends towards greyscale, using the same weights as convert('L')
+    weights = (0.299, 0.587, 0.114)
+    coefficients = []
+    for row in range(3):
+        for col in range(3):
+            identity = 1 if row == col else 0
+            coefficients.append(brightness * contrast * (colour * identity + (1 - colour) * weights[col]))
+    return tuple(coefficients)
+
+
+@dataclass(slots=True)
+class ImageUpdate:
+    """An image waiting to be shown by a viewer"""
+    image_key : str
+    image_path: Path
+    img       : Image.Image
+    title     : str
 
 
 ###########################################################################
@@ -69,24 +177,39 @@ def getRootDir():
 ###########################################################################
 class Viewer(ABC):
     def set_screen_size(self, w, h):
-        self.scale_x = float(self.config.get('IMAGE_POSITION', 'scale_x'))
-        self.scale_y = float(self.config.get('IMAGE_POSITION', 'scale_y'))
-        self.rotation = float(self.config.get('IMAGE_POSITION', 'rotation'))
+        position = self.config['IMAGE_POSITION']
+        self.scale_x = float(position['scale_x'])
+        self.scale_y = float(position['scale_y'])
+        # Rotation is a whole number of degrees, used as a key into ROTATIONS.
+        # Older configs may still spell it as a float, e.g. 270.0
+        rotation = position['rotation']
+        self.rotation = int(float(rotation)) if '.' in rotation else int(rotation)
         if self.scale_x == 0 or self.scale_y == 0:
             logger.error('Scale must not be set to zero! Check config file')
             raise ValueError
         self.screen_width  = int(w)
         self.screen_height = int(h)
-        self.image_width   = int(w * float(self.scale_x))
-        self.image_height  = int(h * float(self.scale_y))
+        self.image_width   = int(w * self.scale_x)
+        self.image_height  = int(h * self.scale_y)
         self.image_size = min(self.image_width, self.image_height)
+        # The screen size and scaling never change while running, so work out
+        # everything process_image_position needs from them once
+        self.screen_size    = (self.screen_width, self.screen_height)
+        self.uniform_scale  = self.scale_x == self.scale_y
+        scale_ratio         = max(self.scale_x, self.scale_y)
+        self.resize_x       = self.scale_x * scale_ratio
+        self.resize_y       = self.scale_y * scale_ratio
+        # Positioned images keyed by image key and the position settings used
+        self.position_cache = OrderedDict()
         
     def startup(self):
         self.load_config()
         # Load initial image
         image_key = getCurrentImageKey()
-        image_path = getSavedImageDir / "album_art_" + image_key + ".jpg"
-        if Path(image_path).exists():
+        if image_key is None:
+            return
+        image_path = getSavedImageDir() / ALBUM_ART_FMT(image_key)
+        if image_path.exists():
             self.update(image_key, image_path, None, "onstartup")
     
     def check_pending_updates(self):
@@ -101,55 +224,76 @@ class Viewer(ABC):
         pass
 
     def fetch_image(self, image_path):
-        if Path(image_path).exists():
+        if image_path.exists():
             # Open the image
             try:
-                img = Image.open(image_path)
+                img = openImage(image_path, self.image_size)
                 return img
             except Exception as e:
                 # Bad file?
-                logger.error(f"Couldn't read image file {image_path}, error: {e}")
+                logger.error("Couldn't read image file %s, error: %s", image_path, e)
                 os.remove(image_path)
                 raise FileNotFoundError
         else:
-            logger.error(f"Couldn't find image file {image_path}")
+            logger.error("Couldn't find image file %s", image_path)
             return None
 
     def load_config(self):
         # Get image rendering controls from config
+        render = self.config['IMAGE_RENDER']
         for name in ['colour_balance', 'contrast', 'sharpness', 'brightness']:
             attr_name = f"{name}_adjustment"
-            setattr(self, attr_name, float(self.config.get('IMAGE_RENDER', f'{name}_adjustment')))
+            setattr(self, attr_name, float(render[attr_name]))
+        # Decide once whether downloaded images need tweaking at all
+        self.needs_enhancement = not (self.contrast_adjustment       == 1 and
+                                      self.colour_balance_adjustment == 1 and
+                                      self.brightness_adjustment     == 1 and
+                                      self.sharpness_adjustment      == 1)
 
         # Get image size and position controls from config
-        self.position_offset_x = int(self.config.get('IMAGE_POSITION', 'position_offset_x'))
-        self.position_offset_y = int(self.config.get('IMAGE_POSITION', 'position_offset_y'))
+        position = self.config['IMAGE_POSITION']
+        self.position_offset_x = int(position['position_offset_x'])
+        self.position_offset_y = int(position['position_offset_y'])
+
 
+    def render_signature(self, image_key):
+        """Identifies the result of rendering image_key with the current settings"""
+        return (image_key, self.rotation, self.scale_x, self.scale_y, self.position_offset_x, self.position_offset_y)
 
-    def process_image_position(self, img):
+    def process_image_position(self, img, image_key=None):
         logger.debug("Starting to process image position")
 
-        if self.rotation == 90:
-            img = img.transpose(Image.ROTATE_90)
-        elif self.rotation == 180:
-            img = img.transpose(Image.ROTATE_180)
-        elif self.rotation == 270:
-            img = img.transpose(Image.ROTATE_270)
+        # Re-use the result if this image was already positioned with the current settings
+        cache_key = self.render_signature(image_key)
+        if image_key is not None and cache_key in self.position_cache:
+            logger.debug("Using cached positioned image")
+            self.position_cache.move_to_end(cache_key)
+            return self.position_cache[cache_key]
+
+        rotate = ROTATIONS.get(self.rotation)
+        if rotate is not None:
+            img = img.transpose(rotate)
 
         # Calculate scaling to fit the screen while maintaining aspect ratio
         img_width, img_height = img.size
 
         # If we somehow downloaded an image of the wrong size, e.g. if screen size or scaling has changed
-        if (not img_width == self.image_width) or (not img_height == self.screen_height) or not self.scale_x == self.scale_y:
+        if (not img_width == self.image_width) or (not img_height == self.screen_height) or not self.uniform_scale:
             logger.debug("Resizing")
-            scale_ratio = max(self.scale_x,self.scale_y)
-            new_width   = int(img_width  * self.scale_x * scale_ratio)
-            new_height  = int(img_height * self.scale_y * scale_ratio)
-            img = img.resize((new_width, new_height), Image.LANCZOS)
+            new_width   = int(img_width  * self.resize_x)
+            new_height  = int(img_height * self.resize_y)
+            # When shrinking, reduce by an integer factor first (as Image.thumbnail does)
+            # so Lanczos only has to filter the last step
+            img = img.resize((new_width, new_height), Image.LANCZOS, reducing_gap=3.0)
 
-        if not (self.screen_width, self.screen_height) == img.size:
+        if not self.screen_size == img.size:
             img = self.pad_image_to_size(img)
 
+        if image_key is not None:
+            self.position_cache[cache_key] = img
+            if len(self.position_cache) > POSITION_CACHE_SIZE:
+                self.position_cache.popitem(last=False)
+
         return img
 
     def pad_image_to_size(self, img):
@@ -160,7 +304,7 @@ class Viewer(ABC):
         
         # Create a new white image with the target dimensions
         logger.debug("Starting creating new image")
-        new_image = Image.new('RGB', (self.screen_width, self.screen_height), color='white')
+        new_image = Image.new('RGB', self.screen_size, color='white')
         logger.debug("Finished creating new image")
         
         # Calculate position to paste the original image
@@ -185,54 +329,136 @@ class EinkViewer(Viewer):
         self.config = config
         self.eink = eink
         self.set_screen_size(self.eink.EPD_WIDTH, self.eink.EPD_HEIGHT)
-        self.update_thread = None
+        self.update_lock = threading.Lock()
+        self.update_timer = None
+        # Images waiting for the render thread; only the latest matters
+        self.render_queue = queue.Queue(maxsize=1)
+        # Guards rendering and the render queue against stop requests going astray
+        self.render_lock = threading.Lock()
+        self.rendering = False
+        # Signature and buffer hash of the last image fully written to the display
+        self.last_render_signature = None
+        self.last_buffer_hash = None
 
         self.epd = eink.EPD()
         self.epd.Init()
         self.startup()
+
+        # One long-lived thread does all the (slow) image processing and
+        # writing to the panel, so update callers never wait on either
+        self.render_thread = threading.Thread(target=self.render_loop, name='eink-render', daemon=True)
+        self.render_thread.start()
     
     def startup(self):
         self.load_config()
         # No need to reload an image, it's still there
 
-    def display_image(self, image_key, img, title):
-        """Display an image"""
-
-        # Render on the eink display
-        logger.debug(f"Starting sending image to display for {title}")
-        # TODO this break stuff, but seems like it should be needed?
-        # self.epd.should_stop = False
-        self.epd.display(self.epd.getbuffer(img), title)
-        self.epd.should_stop = False
-        logger.info(f"Finished sending image to display for {title}")
-        # Update the current image id 
-        setCurrentImageKey(image_key)
+    def render_loop(self):
+        """Prepare and display each image queued by start_update, one at a time"""
+        while True:
+            job = self.render_queue.get()
+            with self.render_lock:
+                # Replaced by a newer image while waking up, go straight to that
+                if not self.render_queue.empty():
+                    continue
+                self.rendering = True
+                # Don't let a stop request meant for the previous image cancel this one
+                self.epd.stop_event.clear()
+            try:
+                self.render(*job)
+            except Exception as e:
+                logger.exception("Error writing to display: %s", e)
+            finally:
+                with self.render_lock:
+                    self.rendering = False
 
-    def update(self, image_key, image_path, img, title):
+    def render(self, image_key, image_path, img, title):
+        """Position and pack an image for the panel, then display it"""
         if img is None:
             img = self.fetch_image(image_path)
         if img is None:
             return
 
-        if self.update_thread is not None:
-            logger.info(f"Setting should_stop triggered by {title}")
-            self.epd.should_stop = True
+        # Process the image position, including scale and offset, and pack it
+        # for the panel
+        img = self.process_image_position(img, image_key)
+        buf = self.epd.getbuffer(img)
+        buf_hash = hashlib.blake2b(buf, digest_size=16).digest()
+
+        # Different keys can still produce identical pixels (e.g. the same
+        # artwork under a new key), which would be a wasted refresh
+        if buf_hash == self.last_buffer_hash:
+            logger.info("Image for %s matches what is displayed, skipping", title)
+            self.last_render_signature = self.render_signature(image_key)
+            setCurrentImageKey(image_key)
+            return
 
-        # Process the image position, including scale and offset while we wait for the thread to stop
-        img = self.process_image_position(img)
+        self.display_image(image_key, buf, title, buf_hash)
 
-        logger.debug(f"Checking previous update thread for {title}")
-        if self.update_thread is not None:
-            while self.update_thread.is_alive():
-                logger.debug(f"Waiting for previous thread to finish for {title}")
-                time.sleep(0.1)
-        logger.debug(f"Creating new update thread for {title}")
+    def display_image(self, image_key, buf, title, buf_hash=None):
+        """Display an image already packed into the panel's buffer format"""
 
-        self.update_thread = threading.Thread(
-            target=self.display_image,
-            args  =(image_key, img, title)
-        )
-        self.update_thread.start()
+        # render_loop clears the stop event before calling this, so if it's
+        # set now a newer update has already been requested
+        if self.epd.stop_event.is_set():
+            logger.info("Skipping display for %s, a newer update is waiting", title)
+            return
+
+        # Render on the eink display
+        logger.debug("Starting sending image to display for %s", title)
+        # Monotonic, so a clock change mid-refresh can't skew the duration
+        start_time = time.monotonic()
+        if self.epd.display(buf, title):
+            self.last_render_signature = self.render_signature(image_key)
+            self.last_buffer_hash = buf_hash
+        else:
+            # Interrupted part way, so the panel no longer shows either image
+            self.last_render_signature = None
+            self.last_buffer_hash = None
+        self.epd.stop_event.clear()
+        logger.info("Finished sending image to display for %s in %.1fs", title, time.monotonic() - start_time)
+        # Update the current image id 
+        setCurrentImageKey(image_key)
+
+    def update(self, image_key, image_path, img, title):
+        # Wait for requests to settle (e.g. skipping through several tracks) so
+        # only the last one in a burst gets sent to the display
+        with self.update_lock:
+            if self.update_timer is not None:
+                self.update_timer.cancel()
+            self.update_timer = threading.Timer(
+                UPDATE_DEBOUNCE,
+                self.start_update,
+                args  =(image_key, image_path, img, title)
+            )
+            self.update_timer.start()
+
+    def start_update(self, image_key, image_path, img, title):
+        # Only one caller at a time may queue an update
+        with self.update_lock:
+            # A newer request arrived while this timer was waiting for the lock
+            if threading.current_thread() is not self.update_timer:
+                logger.debug("Dropping superseded update for %s", title)
+                return
+
+            # Whether the panel is being, or about to be, written to
+            with self.render_lock:
+                busy = self.rendering or not self.render_queue.empty()
+
+            # Nothing to do if this exact render is already on the display
+            if not busy and self.render_signature(image_key) == self.last_render_signature:
+                logger.info("Image for %s is already displayed, skipping", title)
+                return
+
+            # Fetching, positioning and packing all happen on the render
+            # thread, so this only has to hand the request over
+            logger.debug("Queueing update for %s", title)
+            with self.render_lock:
+                putLatest(self.render_queue, (image_key, image_path, img, title))
+                # Whatever is being prepared or displayed must make way for this
+                if self.rendering:
+                    logger.info("Requesting stop, triggered by %s", title)
+                    self.epd.stop_event.set()
 
 
 ###########################################################################
@@ -261,9 +487,13 @@ class TkViewer(Viewer):
         # For fullscreen
         self.root.attributes('-fullscreen', True)
         
-        # Create label to display the image
-        self.label = tk.Label(root)
+        # Create label to display the image. Positioned images are always
+        # screen sized, so one PhotoImage is created up front and painted into
+        self.photo = ImageTk.PhotoImage('RGB', self.screen_size)
+        self.label = tk.Label(root, image=self.photo)
         self.label.pack(fill=tk.BOTH, expand=True)
+        # Keep a reference to prevent garbage collection
+        self.label.image = self.photo
         
         # Bind Escape key to close the window
         self.root.bind('<Escape>', lambda e: self.root.destroy())
@@ -271,49 +501,53 @@ class TkViewer(Viewer):
         # Handle window close button (X)
         self.root.protocol("WM_DELETE_WINDOW", self.root.destroy)
         
-        # Variable to store the latest requested image path
-        self.pending_image_path = None
+        # The latest requested image update. A one item queue, so handing an
+        # update from a background thread to the Tk thread can't lose one
+        self.pending_updates = queue.Queue(maxsize=1)
+        
+        # Background threads ask for the pending update to be shown with this
+        # virtual event, so Tk only wakes up when there is something to do
+        self.root.bind('<<NewImage>>', lambda e: self.check_pending_updates())
         
         # Fetch, process, display the image
         self.startup()
 
     def check_pending_updates(self):
-        # Schedule next check (every 100ms)
-        self.root.after(100, self.check_pending_updates)
-
-        """Check if there's a pending image update"""
-        if self.pending_image_path is not None:
-            self.display_image(self.pending_image_path)
-            logger.info("Updated displayed image")
-            self.pending_image_path = None
-#        else:
-#            logger.debug("No new image found")
+        """Display the pending image update, if there is one"""
+        try:
+            update = self.pending_updates.get_nowait()
+        except queue.Empty:
+            return
+        self.display_image(update.image_key, update.image_path, update.title, update.img)
+        logger.info("Updated displayed image")
     
-    def display_image(self, image_key, image_path, title):
+    def display_image(self, image_key, image_path, title, img=None):
         """Display an image (should only be called from the main thread)"""
-        img = self.fetch_image(image_path)
+        if img is None:
+            img = self.fetch_image(image_path)
         if img is None:
             return
 
         # Process the image position, including scale and offset
-        img = self.process_image_position(img)
+        img = self.process_image_position(img, image_key)
 
-        # Convert to PhotoImage
-        self.photo = ImageTk.PhotoImage(img)
-        
-        # Update the label
-        self.label.configure(image=self.photo)
-        
-        # Keep a reference to prevent garbage collection
-        self.label.image = self.photo
+        # Copy into the label's existing PhotoImage rather than making a new one
+        self.photo.paste(img)
 
         # Update the current image id 
         setCurrentImageKey(image_key)
         
     def update(self, image_key, image_path, img, title):
         """Thread-safe method to request an image update from anywhere"""
-        # Store the latest image path instead of directly updating
-        self.pending_image_path = image_path
+        # Store the latest update instead of directly updating, replacing
+        # any that hasn't been shown yet
+        putLatest(self.pending_updates, ImageUpdate(image_key, image_path, img, title))
+        try:
+            # Tk queues the event for the main thread's loop
+            self.root.event_generate('<<NewImage>>', when='tail')
+        except RuntimeError:
+            # The main loop isn't running yet; it drains the queue once it starts
+            pass
 
 
 ###########################################################################
@@ -322,6 +556,14 @@ class TkViewer(Viewer):
 ###########################################################################
 ###########################################################################
 class RoonAlbumArt:
+    # Roon's now_playing text layouts, most detailed first, with the lines
+    # each provides for track, artist and album
+    TRACK_LINE_FORMATS = (
+        ('three_line', ('line1', 'line2', 'line3')),
+        ('two_line',   ('line1', 'line2')),
+        ('one_line',   ('line1',)),
+    )
+    
     def __init__(self, config, viewer):
         # Set up logging first
         logger.info("Starting Roon Album Art Display")
@@ -330,11 +572,15 @@ class RoonAlbumArt:
         self.viewer = viewer;
         self.config = config
         
+        # Set to shut down; an Event so waiting threads wake up straight away
+        self.stop_event = threading.Event()
+        
         # Get zone info from config
-        self.allowed_zone_names   = [zone for zone in self.config.get('ZONES', 'allowed_zone_names').split(',') if zone]
-        self.forbidden_zone_names = [zone for zone in self.config.get('ZONES', 'forbidden_zone_names').split(',') if zone]
-        logger.info(f"Allowed zone names: {json.dumps(self.allowed_zone_names)}")
-        logger.info(f"Forbidden zone names: {json.dumps(self.forbidden_zone_names)}")
+        # Stored as frozensets as they are checked on every zone event
+        self.allowed_zone_names   = frozenset(zone for zone in self.config.get('ZONES', 'allowed_zone_names').split(',') if zone)
+        self.forbidden_zone_names = frozenset(zone for zone in self.config.get('ZONES', 'forbidden_zone_names').split(',') if zone)
+        logger.info("Allowed zone names: %s", json.dumps(sorted(self.allowed_zone_names)))
+        logger.info("Forbidden zone names: %s", json.dumps(sorted(self.forbidden_zone_names)))
         
         # Get app info from config
         self.app_info = {
@@ -345,13 +591,36 @@ class RoonAlbumArt:
             "email":           self.config.get('APP', 'email'),
         }
         
+        # Keep connections to the Roon server open between album art downloads
+        self.http = requests.Session()
+        self.http.mount('http://', HTTPAdapter(
+            pool_connections = 2,
+            pool_maxsize     = 8,
+            max_retries      = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+        ))
+        
+        # Album art is fetched on a single background worker so slow downloads
+        # don't hold up Roon's callback thread. Only the latest request matters.
+        self.fetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='roon-art')
+        self.fetch_lock = threading.Lock()
+        self.pending_image_key = None
+        # Recently downloaded images, only touched by the fetch worker
+        self.image_cache = OrderedDict()
+        
+        # Zone events are handed off to the event loop thread so Roon's
+        # callback thread is never held up by our processing
+        self.zone_queue = queue.Queue(maxsize=ZONE_QUEUE_SIZE)
+        
+        # Album art directory, fixed for the life of the process
+        self.image_dir = getSavedImageDir()
+        self.image_dir.mkdir(parents=True, exist_ok=True)
+        
         # Path for token storage
         self.token_file = Path.home() / ".roon_album_display_token.txt"
-        logger.info(f"Token file path: {self.token_file}")
+        logger.info("Token file path: %s", self.token_file)
         
         # Initiate some variables
         self.current_image_path = None
-        self.last_event = None
         display_type = self.config.get('DISPLAY', 'type')
         if display_type == 'system_display':
             self.last_image_key = None
@@ -361,21 +630,16 @@ class RoonAlbumArt:
         # Connect to Roon - do this BEFORE starting to display an image
         logger.info("Connecting to Roon before starting display...")
         self.roon = self.connect_to_roon()
-        if not hasattr(self.roon, '_roonsocket'):
-            raise Error
-        if not hasattr(self.roon._roonsocket, 'failed_state'):
-            raise Error
-        if self.roon._roonsocket.failed_state:
-            raise Error
+        # Resolve the socket once; a missing socket or flag counts as failed
+        roon_socket = getattr(self.roon, '_roonsocket', None)
+        if getattr(roon_socket, 'failed_state', True):
+            raise ConnectionError("Could not establish a working connection to Roon")
         
         # Get current album
         for key, dictionary in self.roon.zones.items():
             result = self.process_zone_data(key, dictionary)
             if result is not False:
                 break
-
-        # Event handling
-        self.running = True
     
     def save_server_to_config(self, server_ip, server_port):
         """Save the server IP and port to config file for future use"""
@@ -388,23 +652,31 @@ class RoonAlbumArt:
             self.config['SERVER']['ip'] = server_ip
             self.config['SERVER']['port'] = str(server_port)
             
-            # Write to file
-            with open(cfgpath, 'w') as configfile:
+            # Write to a temporary file first so a bad write can't lose the config
+            tmp_path = getTempPath(Path(cfgpath))
+            with open(tmp_path, 'w') as configfile:
                 self.config.write(configfile)
+            os.replace(tmp_path, cfgpath)
                 
-            logger.info(f"Saved server details ({server_ip}:{server_port}) to config for future use")
+            logger.info("Saved server details (%s:%s) to config for future use", server_ip, server_port)
         except Exception as e:
-            logger.error(f"Error saving server details to config: {e}")
+            logger.error("Error saving server details to config: %s", e)
             
-    def connect_to_roon(self):
-        """Connect to Roon server using saved details or discovery"""
-        # Get token from file if it exists
-        token = None
-        if self.token_file.exists():
+    def get_token(self):
+        """Get the auth token from file if it exists"""
+        try:
             token = self.token_file.read_text().strip()
+        except FileNotFoundError:
+            token = None
+        if token:
             logger.info("Found existing auth token")
-        else:
-            logger.info("No existing auth token found, will need to authorize in Roon")
+            return token
+        logger.info("No existing auth token found, will need to authorize in Roon")
+        return None
+
+    def connect_to_roon(self):
+        """Connect to Roon server using saved details or discovery"""
+        token = self.get_token()
         
         # First try direct connection with saved settings
         try:
@@ -413,7 +685,7 @@ class RoonAlbumArt:
                 server_port = self.config.getint('SERVER', 'port')
                 
                 if server_ip and server_port:
-                    logger.info(f"Trying direct connection to saved server at {server_ip}:{server_port}")
+                    logger.info("Trying direct connection to saved server at %s:%s", server_ip, server_port)
                     try:
                         api = RoonApi(self.app_info, token, server_ip, server_port)
                         # Add validation to confirm the connection is actually working
@@ -423,7 +695,7 @@ class RoonAlbumArt:
                                 zones = api.zones
                                 if zones is not None and zones:
                                     logger.info("Successfully connected to saved server!")
-                                    logger.debug(f"Zones data: {zones}")
+                                    logger.debug("Zones data: %s", zones)
                                     return api
                                 else:
                                     api.stop()
@@ -434,48 +706,54 @@ class RoonAlbumArt:
                             logger.warning("API instance created but appears to be invalid")
                             raise Exception("Invalid API instance")
                     except Exception as e:
-                        logger.warning(f"Failed to connect to saved server: {e}")
+                        logger.warning("Failed to connect to saved server: %s", e)
                         logger.info("Falling back to discovery...")
                 else:
                     logger.info("Saved server details incomplete, using discovery")
         except Exception as e:
-            logger.warning(f"Error reading saved server details: {e}")
+            logger.warning("Error reading saved server details: %s", e)
             logger.info("Falling back to discovery...")
         
         # If direct connection failed or no saved details, use discovery
-        return self.discover_and_connect()
+        return self.discover_and_connect(token)
 
-    def discover_and_connect(self):
+    def discover_and_connect(self, token):
         """Discover Roon servers on the network and connect to the first one found"""
-        # Get token from file if it exists
-        token = None
-        if self.token_file.exists():
-            token = self.token_file.read_text().strip()
-            logger.info("Discovery: found existing auth token")
-        else:
-            logger.info("Discovery: no existing auth token found, will need to authorize in Roon")
-        
         # Start discovery process
         logger.info("Starting Roon server discovery...")
         discover = RoonDiscovery(None)
         
-        while True:
-            servers = discover.all()
-            if servers:
-                logger.info(f"Found {len(servers)} Roon server(s)")
-                break
-            
-            logger.info("Waiting for Roon servers to be discovered...")
-            time.sleep(1)
-        
-        # Stop discovery
-        logger.debug("Shutting down discovery")
-        discover.stop()
+        try:
+            # Poll with backoff until a server turns up. The core may just be
+            # slow to start, so keep waiting but complain now and then
+            backoff    = DISCOVERY_BACKOFF_MIN
+            start_time = time.monotonic()
+            polls      = 0
+            while True:
+                servers = discover.all()
+                if servers:
+                    logger.info("Found %s Roon server(s)", len(servers))
+                    break
+
+                polls += 1
+                if polls % DISCOVERY_WARN_POLLS == 0:
+                    logger.warning("Still no Roon server found after %.0fs, is the core running?",
+                                   time.monotonic() - start_time)
+                
+                logger.info("Waiting for Roon servers to be discovered...")
+                # Wait on the stop event so shutting down doesn't wait out the backoff
+                if self.stop_event.wait(backoff):
+                    raise InterruptedError("Stopped while discovering Roon servers")
+                backoff = min(backoff * 1.5, DISCOVERY_BACKOFF_MAX)
+        finally:
+            # Stop discovery, even if interrupted, so the socket isn't leaked
+            logger.debug("Shutting down discovery")
+            discover.stop()
         
         # Only connect to the first server found
         server = servers[0]
         server_ip, server_port = server
-        logger.info(f"Connecting to first Roon server found at {server_ip}:{server_port}")
+        logger.info("Connecting to first Roon server found at %s:%s", server_ip, server_port)
         
         # Try to connect to the server
         try:
@@ -487,14 +765,16 @@ class RoonAlbumArt:
                 
                 while api.token is None:
                     logger.info("Please approve this extension in the Roon app...")
-                    time.sleep(2)
+                    # roonapi has no callback for the token arriving, so poll
+                    if self.stop_event.wait(2):
+                        raise InterruptedError("Stopped while waiting for authorization")
 
                 # Save the token for future use
-                self.token_file.write_text(api.token)
+                writeTextAtomic(self.token_file, api.token)
                 logger.info("Authorization successful, token saved for future connections")
                 
             elif api is not None:
-                logger.info(f"Successfully connected using existing token")
+                logger.info("Successfully connected using existing token")
 
             # Save server details for future connections
             self.save_server_to_config(server_ip, server_port)
@@ -503,7 +783,7 @@ class RoonAlbumArt:
             return api
             
         except Exception as e:
-            logger.exception(f"Error connecting to Roon server at {server_ip}:{server_port}: {e}")
+            logger.exception("Error connecting to Roon server at %s:%s: %s", server_ip, server_port, e)
             return None
     
     
@@ -517,13 +797,38 @@ class RoonAlbumArt:
             logger.info("Successfully registered for state callbacks")
             
         except Exception as e:
-            logger.error(f"Error subscribing to Roon events: {e}")
+            logger.error("Error subscribing to Roon events: %s", e)
             logger.exception("Detailed traceback:")
     
     def zone_event_callback(self, event_type, data):
+        """Queue state update events from Roon for the event loop"""
+        self.queue_zone_event((event_type, data))
+    
+    def queue_zone_event(self, event):
+        """Add an event to the zone queue, dropping the oldest if it's full"""
+        putLatest(self.zone_queue, event)
+    
+    def coalesce_zone_events(self, events):
+        """Merge a burst of zone events so each zone is processed once. Zone
+        data is looked up when handled, so the latest state is always used"""
+        zone_ids = {}
+        event_type = None
+        for event in events:
+            if event is None:
+                continue
+            event_type, data = event
+            if isinstance(data, list):
+                zone_ids.update(dict.fromkeys(data))
+            else:
+                # Let handle_zone_event report anything unexpected
+                yield event
+        if zone_ids:
+            yield (event_type, list(zone_ids))
+    
+    def handle_zone_event(self, event_type, data):
         """Handle state update events from Roon"""
         try:
-            logger.debug(f"Processing {event_type} event")
+            logger.debug("Processing %s event", event_type)
             
             # Handle list data structure
             if isinstance(data, list):
@@ -532,15 +837,20 @@ class RoonAlbumArt:
                     if isinstance(zone_item, str):
                         zone_data = self.roon.zones.get(zone_item)
                         if zone_data:
+                            # Most events are volume/seek/queue changes: skip them cheaply
+                            # when the zone is still showing the image we already have
+                            now_playing = zone_data.get("now_playing") if isinstance(zone_data, dict) else None
+                            if now_playing and now_playing.get("image_key") == self.last_image_key:
+                                continue
                             self.process_zone_data(zone_item, zone_data)
                         else:
-                            logger.warning(f"No zone data found for zone ID: {zone_item}")
+                            logger.warning("No zone data found for zone ID: %s", zone_item)
             
             else:
-                logger.warning(f"Unexpected data format in {event_type} event: {type(data)}")
+                logger.warning("Unexpected data format in %s event: %s", event_type, type(data))
             
         except Exception as e:
-            logger.error(f"Error in zone event callback: {e}")
+            logger.error("Error in zone event callback: %s", e)
             logger.exception("Detailed traceback:")
     
     def process_zone_data(self, zone_id, zone_data):
@@ -548,54 +858,47 @@ class RoonAlbumArt:
         result = False
         try:
             # Log zone data structure for debugging
-            logger.debug(f"Processing zone {zone_id}, data keys: {zone_data.keys() if isinstance(zone_data, dict) else 'not a dict'}")
+            logger.debug("Processing zone %s, data keys: %s", zone_id, zone_data.keys() if isinstance(zone_data, dict) else 'not a dict')
             
             name = zone_data['display_name']
-            if self.forbidden_zone_names and name in self.forbidden_zone_names:
-                logger.debug(f"Received event from zone {name} but it is in the forbidden list")
+            if name in self.forbidden_zone_names:
+                logger.debug("Received event from zone %s but it is in the forbidden list", name)
                 return False
-            if self.allowed_zone_names and not name in self.allowed_zone_names:
-                logger.debug(f"Received event from zone {name} but it is not in the allowed list")
+            if self.allowed_zone_names and name not in self.allowed_zone_names:
+                logger.debug("Received event from zone %s but it is not in the allowed list", name)
                 return False
 
             # Check if the zone has now_playing information
-            if isinstance(zone_data, dict):
-                # Direct now_playing object
-                if "now_playing" in zone_data and zone_data["now_playing"]:
-                    now_playing = zone_data["now_playing"]
-                    result = self.process_now_playing(now_playing)
-                
-                # Check if it might be in a nested structure
-                elif "state" in zone_data and isinstance(zone_data["state"], dict):
-                    if "now_playing" in zone_data["state"] and zone_data["state"]["now_playing"]:
-                        now_playing = zone_data["state"]["now_playing"]
-                        result = self.process_now_playing(now_playing)
-                
-                # Check if this is a different API structure
-                elif "display_name" in zone_data and "queue" in zone_data and "now_playing" in zone_data.get("queue", {}):
-                    now_playing = zone_data["queue"]["now_playing"]
-                    result = self.process_now_playing(now_playing)
+            now_playing = self.extract_now_playing(zone_data)
+            if now_playing:
+                result = self.process_now_playing(now_playing)
 
             return result
 
         except Exception as e:
-            logger.error(f"Error processing zone data: {e}")
-            logger.debug(f"Zone data that caused error: {str(zone_data)[:200]}...")
+            logger.error("Error processing zone data: %s", e)
+            logger.debug("Zone data that caused error: %.200s...", zone_data)
             
+    def extract_now_playing(self, zone_data):
+        """Find now_playing directly in the zone, or nested in its state or queue"""
+        now_playing = zone_data.get("now_playing")
+        if now_playing:
+            return now_playing
+        # Roon's zone "state" is usually a plain string, so only look inside dicts
+        for section in ("state", "queue"):
+            nested = zone_data.get(section)
+            if isinstance(nested, dict) and nested.get("now_playing"):
+                return nested["now_playing"]
+        return None
+    
     def process_now_playing(self, now_playing):
         """Process the now_playing object to extract image and track info"""
         result = False
         try:
-            logger.debug(f"Now playing keys: {now_playing.keys() if isinstance(now_playing, dict) else 'not a dict'}")
+            logger.debug("Now playing keys: %s", now_playing.keys() if isinstance(now_playing, dict) else 'not a dict')
 
-            # Don't process duplicate events
-            if now_playing == self.last_event:
-                # Always log the event type for debugging
-                logger.debug(f"Ignoring duplicate event {str(now_playing)}")
-                return False
-            self.last_event = now_playing
-            
-            # First, try to get the image_key
+            # First, try to get the image_key. Duplicate events are caught by
+            # the image key check below, so there's no need to compare whole events
             image_key = None
             
             if isinstance(now_playing, dict):
@@ -603,79 +906,89 @@ class RoonAlbumArt:
                     image_key = now_playing["image_key"]
             
             if not image_key:
-                logger.warning(f"No image key found in now_playing data {now_playing}")
+                logger.warning("No image key found in now_playing data %s", now_playing)
                 return False
                 
             # Only update if the image has changed
             if image_key != self.last_image_key:
-                logger.info(f"New track detected with image key: {image_key}")
+                logger.info("New track detected with image key: %s", image_key)
                 self.last_image_key = image_key
                 
                 # Now try to get track information
-                track_info  = "Unknown Track"
-                artist_info = "Unknown Artist"
-                album_info  = "Unknown Album"
+                track_info, artist_info, album_info = self.extract_track_info(now_playing)
                 
-                # Try to extract track info from different possible structures
-                if isinstance(now_playing, dict):
-                    # Try one_line/two_line/three_line structure
-                    if "three_line" in now_playing and isinstance(now_playing["three_line"], dict):
-                        track_info  = now_playing["three_line"].get("line1", track_info)
-                        artist_info = now_playing["three_line"].get("line2", artist_info)
-                        album_info  = now_playing["three_line"].get("line3", album_info)
-                    elif "two_line" in now_playing and isinstance(now_playing["two_line"], dict):
-                        track_info  = now_playing["two_line"].get("line1", track_info)
-                        artist_info = now_playing["two_line"].get("line2", artist_info)
-                    elif "one_line" in now_playing and isinstance(now_playing["one_line"], dict):
-                        track_info = now_playing["one_line"].get("line1", track_info)
-                    
                 # Log track information
-                logger.info(f"Now Playing: {track_info} - {artist_info} - {album_info}")
+                logger.info("Now Playing: %s - %s - %s", track_info, artist_info, album_info)
                 
-                # Fetch and display the album art
-                self.fetch_and_display_album_art(image_key, track_info)
+                # Fetch and display the album art in the background
+                with self.fetch_lock:
+                    self.pending_image_key = image_key
+                self.fetch_pool.submit(self.fetch_and_display_album_art, image_key, track_info)
                 result = image_key
             else:
-                logger.debug(f"Update contains the same image as is currently displayed")
+                logger.debug("Update contains the same image as is currently displayed")
 
             return result
 
         except Exception as e:
-            logger.error(f"Error processing now_playing data: {e}")
-            logger.debug(f"Now playing data that caused error: {str(now_playing)[:200]}...")
+            logger.error("Error processing now_playing data: %s", e)
+            logger.debug("Now playing data that caused error: %.200s...", now_playing)
+    
+    def extract_track_info(self, now_playing):
+        """Return (track, artist, album) from the most detailed layout available"""
+        track_lines = ["Unknown Track", "Unknown Artist", "Unknown Album"]
+        for layout, lines in self.TRACK_LINE_FORMATS:
+            section = now_playing.get(layout)
+            if isinstance(section, dict):
+                for i, line in enumerate(lines):
+                    track_lines[i] = section.get(line, track_lines[i])
+                break
+        return track_lines
     
     def fetch_and_display_album_art(self, image_key, track_info):
         """Fetch album art from Roon and save it"""
+        # Skip requests superseded while queued, e.g. when skipping through tracks
+        with self.fetch_lock:
+            if image_key != self.pending_image_key:
+                logger.debug("Skipping superseded album art fetch for %s", image_key)
+                return
+
         try:
             # Create a file path for the image
-            image_path = getSavedImageDir() / f"album_art_{image_key}.jpg"
+            image_path = self.image_dir / ALBUM_ART_FMT(image_key)
             
-            if os.path.exists(image_path):
-                logger.debug(f"File already exists at {image_path}")
-                img = None
+            img = self.image_cache.get(image_key)
+            if img is not None:
+                logger.debug("Using album art for %s from memory", image_key)
+                self.image_cache.move_to_end(image_key)
+            elif self.cached_image_exists(image_path):
+                logger.debug("File already exists at %s", image_path)
             else:
                 # Fetch the image from Roon
                 image_url = self.roon.get_image(image_key, "fit", self.viewer.image_size, self.viewer.image_size)
-                logger.info(f"Fetching album art from: {image_url}")
-                response = self.download_image(image_url)
-
-                # Write the image first so we can load it properly
-                # Converting bytes directly to an image doesn't seem to work well
-                with open(image_path, 'wb') as file:
-                    file.write(response)
-
-                img = Image.open(image_path)
-
-                # Apply image rendering effects
-                if not (self.viewer.contrast_adjustment       == 1 and
-                        self.viewer.colour_balance_adjustment == 1 and
-                        self.viewer.brightness_adjustment     == 1 and
-                        self.viewer.sharpness_adjustment     == 1):
+                logger.info("Fetching album art from: %s", image_url)
+                if self.viewer.needs_enhancement:
+                    # Decode in memory and write only the tweaked image to disk
+                    data = self.download_image(image_url)
+                    if data is None:
+                        return
+                    img = openImage(BytesIO(data), self.viewer.image_size)
+                    img.load()
                     img = self.tweak_image(img)
-
-                # Cache image for later
-                img.save(image_path)
-                logger.info(f"Successfully saved album art to {image_path}")
+                    self.save_image(img, image_path)
+                else:
+                    # Nothing to change, so store the download exactly as received
+                    if not self.download_image_to_file(image_url, image_path):
+                        return
+                    img = openImage(image_path, self.viewer.image_size)
+                    # Decode now, on this worker, rather than later in the viewer
+                    img.load()
+                logger.info("Successfully saved album art to %s", image_path)
+
+                # Keep the decoded, tweaked image around in case this track comes back
+                self.image_cache[image_key] = img
+                if len(self.image_cache) > IMAGE_CACHE_SIZE:
+                    self.image_cache.popitem(last=False)
 
             # Update the current image id 
             #setCurrentImageKey(image_key)
@@ -685,53 +998,98 @@ class RoonAlbumArt:
             self.viewer.update(image_key, image_path, img, track_info)
                 
         except Exception as e:
-            logger.error(f"Error fetching album art: {e}")
+            logger.error("Error fetching album art: %s", e)
 
 
+    def cached_image_exists(self, image_path):
+        """Check for a usable cached image. Downloads are moved into place only
+        once complete, so an empty file is the only bad state to guard against"""
+        try:
+            return image_path.stat().st_size > 0
+        except FileNotFoundError:
+            return False
+
     def download_image(self, image_url):
+        """Download an image and return its data"""
         try:
             # Send GET request to the image URL
-            response = requests.get(image_url, stream=True)
+            response = self.http.get(image_url, timeout=DOWNLOAD_TIMEOUT)
             
             # Check if the request was successful
             response.raise_for_status()
                     
-            logger.debug(f"Image successfully downloaded")
+            logger.debug("Image successfully downloaded")
             return response.content
             
         except requests.exceptions.RequestException as e:
-            logger.exception(f"Error downloading image: {e}")
+            logger.exception("Error downloading image: %s", e)
+            return None
+
+    def download_image_to_file(self, image_url, image_path):
+        """Download an image to image_path, via a temporary file so an
+        interrupted download never leaves a partial image in the cache"""
+        tmp_path = getTempPath(image_path)
+        try:
+            # Send GET request to the image URL. The with block hands the
+            # connection back to the pool once the body has been copied
+            with self.http.get(image_url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                # Check if the request was successful
+                response.raise_for_status()
+
+                # Copy the body straight from the socket to disk in 64K blocks
+                response.raw.decode_content = True
+                try:
+                    with open(tmp_path, 'wb') as file:
+                        shutil.copyfileobj(response.raw, file, 1 << 16)
+                    os.replace(tmp_path, image_path)
+                except BaseException:
+                    # Don't leave the partial file behind, nothing else cleans up .tmp files
+                    tmp_path.unlink(missing_ok=True)
+                    raise
+                    
+            logger.debug("Image successfully downloaded")
+            return True
+            
+        # Reading response.raw directly raises urllib3's own errors (read
+        # timeouts, resets) rather than wrapping them in RequestException
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, OSError) as e:
+            logger.exception("Error downloading image: %s", e)
             return False
 
+    def save_image(self, img, image_path):
+        """Save an image as JPEG, replacing any existing file in one step"""
+        tmp_path = getTempPath(image_path)
+        try:
+            img.save(tmp_path, 'JPEG')
+            os.replace(tmp_path, image_path)
+        except BaseException:
+            # Don't leave the partial file behind, nothing else cleans up .tmp files
+            tmp_path.unlink(missing_ok=True)
+            raise
+
     def tweak_image(self, img):
         logger.debug('Starting image tweaking')
         
         # Check if img is actually a PIL Image object
         try:
-            if not hasattr(img, 'mode') or not callable(getattr(img, 'convert', None)):
-                logger.error(f'Input is not a valid PIL Image: {type(img)}')
+            if not isinstance(img, Image.Image):
+                logger.error('Input is not a valid PIL Image: %s', type(img))
                 return img
                 
-            logger.debug(f'Image type: {type(img)}, mode: {img.mode}, size: {img.size}')
-            
-            # Make a copy of the image to avoid modifying the original
-            img = img.copy()
-            
-            # Apply enhancements with additional error checking
-            if self.viewer.colour_balance_adjustment != 1:
-                logger.debug('Creating color enhancer...')
-                enhancer = ImageEnhance.Color(img)
-                logger.debug('Applying color enhancement...')
-                img = enhancer.enhance(self.viewer.colour_balance_adjustment)
-                logger.debug('Color enhancement complete')
+            logger.debug('Image type: %s, mode: %s, size: %s', type(img), img.mode, img.size)
             
-            if self.viewer.contrast_adjustment != 1:
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(self.viewer.contrast_adjustment)
-            
-            if self.viewer.brightness_adjustment != 1:
-                enhancer = ImageEnhance.Brightness(img)
-                img = enhancer.enhance(self.viewer.brightness_adjustment)
+            # No defensive copy needed: convert() and the enhancers all return new images
+            colour     = self.viewer.colour_balance_adjustment
+            contrast   = self.viewer.contrast_adjustment
+            brightness = self.viewer.brightness_adjustment
+
+            # Colour, contrast and brightness are all linear per-pixel blends, so
+            # fold them into one colour matrix and apply it in a single pass
+            if not (colour == 1 and contrast == 1 and brightness == 1):
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                logger.debug('Applying colour, contrast and brightness matrix...')
+                img = img.convert('RGB', self.enhancement_matrix(img, colour, contrast, brightness))
             
             if self.viewer.sharpness_adjustment != 1:
                 enhancer = ImageEnhance.Sharpness(img)
@@ -741,11 +1099,22 @@ class RoonAlbumArt:
             return img
         
         except Exception as e:
-            import traceback
-            logger.error(f'Error during image enhancement: {str(e)}')
-            logger.error(traceback.format_exc())
+            # One record carrying the traceback, rather than one call per part
+            logger.exception('Error during image enhancement: %s', e)
             # Return the original image if enhancement fails
             return img
+
+    def enhancement_matrix(self, img, colour, contrast, brightness):
+        """Build the RGB conversion matrix applying colour, contrast and brightness to img"""
+        coefficients = getColourMatrix(colour, contrast, brightness)
+
+        # Contrast blends towards the mean grey level, which colour does not change
+        offset = 0
+        if contrast != 1:
+            mean = int(ImageStat.Stat(img.convert('L')).mean[0] + 0.5)
+            offset = brightness * (1 - contrast) * mean
+
+        return coefficients[0:3] + (offset,) + coefficients[3:6] + (offset,) + coefficients[6:9] + (offset,)
     
     
     def cleanup(self):
@@ -761,6 +1130,9 @@ class RoonAlbumArt:
         if self.roon:
             print("Disconnecting from Roon...")
             self.roon.stop()
+
+        self.fetch_pool.shutdown(wait=False, cancel_futures=True)
+        self.http.close()
     
     def run(self):
         """Run the application"""
@@ -773,14 +1145,29 @@ class RoonAlbumArt:
         )
         api_thread.start()
 
+    def stop(self):
+        """Ask the event loop to stop, it cleans up on the way out"""
+        self.stop_event.set()
+        # Wake the loop if it's waiting for a zone event
+        self.queue_zone_event(None)
+
     def event_loop(self):
         try:
             logger.info("Event loop started")
-            while self.running:
-                # Don't use 100% CPU
-                time.sleep(0.1)
+            # Process zone events until asked to stop. A None event only
+            # wakes the loop up so it can see stop_event
+            while not self.stop_event.is_set():
+                events = [self.zone_queue.get()]
+                # Anything else that queued up meanwhile is handled in the same pass
+                while True:
+                    try:
+                        events.append(self.zone_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                for event in self.coalesce_zone_events(events):
+                    self.handle_zone_event(*event)
         except Exception as e:
-            logger.exception(f"Error in event loop: {e}")
+            logger.exception("Error in event loop: %s", e)
         finally:
             # Clean up
             self.cleanup()
@@ -888,9 +1275,7 @@ class RoonFrameConfig:
 
 
 if __name__ == "__main__":
-    dir = getSavedImageDir()
-    if not os.path.exists(dir):
-       os.mkdir(dir)
+    getSavedImageDir().mkdir(parents=True, exist_ok=True)
 
     # Load config
     config = RoonFrameConfig().config
@@ -920,11 +1305,12 @@ if __name__ == "__main__":
     # Now start the UI loop on the main thread
     try:
         if display_type == 'system_display':
-            # Start periodic check for image updates for Tkinter
-            viewer.check_pending_updates()
+            # Show anything requested before the Tk loop was running. Scheduled
+            # from inside the loop, so updates that arrive while it's starting
+            # up are picked up too
+            viewer.root.after_idle(viewer.check_pending_updates)
             viewer.root.mainloop()
     except KeyboardInterrupt:
         print("Shutting down...")
-        ui.running = False
-        api.stop()
+        display.stop()
 
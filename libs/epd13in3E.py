@@ -28,11 +28,13 @@
 #
 import time
 import sys
+import threading
 import logging
 import epdconfig
 
 import PIL
 from PIL import Image
+import numpy as np
 import io
 import inspect
 
@@ -77,7 +79,23 @@ class EPD():
         self.EPD_BUSY_PIN  = epdconfig.EPD_BUSY_PIN
         self.EPD_PWR_PIN  = epdconfig.EPD_PWR_PIN
 
-        self.should_stop = False
+        # Create a pallette with the 7 colors supported by the panel, once
+        # rather than on every getbuffer call
+        self.pal_image = Image.new("P", (1,1))
+        # original
+        #self.pal_image.putpalette( (0,0,0,  255,255,255,  255,255,0,  255,0,0,  0,0,0,  0,0,255,  0,255,0) + (0,0,0)*249)
+        # claude suggests
+        #self.pal_image.putpalette((25,30,33, 241,241,241, 49,49,143, 83,164,40, 210,14,19, 184,94,28, 243,207,17) + (0,0,0)*249)
+        self.pal_image.putpalette((0,0,0, 255,255,255, 255,236,35, 209,0,0, 0,0,0, 35,35,255, 0,208,65) + (0,0,0)*249)
+        # not sure?
+        #self.pal_image.putpalette((0,0,0,  255,255,255,  0,255,0,   0,0,255,  255,0,0,  255,255,0, 255,128,0) + (0,0,0)*249)
+        # The panel size never changes, so the packed buffer (two pixels per
+        # byte) is allocated once and reused
+        self.pack_out = np.empty(self.width * self.height // 2, dtype=np.uint8)
+
+        # Set from another thread to cancel the update in progress. An Event,
+        # so the busy wait can block on it and wake as soon as it's set
+        self.stop_event = threading.Event()
         # In case the script somehow restarts while the display is powered on,
         # shut it down here
         # segfaults: self.writePower(False, "Startup")
@@ -85,6 +103,18 @@ class EPD():
         self.powered_on = False
 
     
+    # Kept for callers that still treat the stop flag as a plain attribute
+    @property
+    def should_stop(self):
+        return self.stop_event.is_set()
+
+    @should_stop.setter
+    def should_stop(self, value):
+        if value:
+            self.stop_event.set()
+        else:
+            self.stop_event.clear()
+
     def Reset(self):
         epdconfig.digital_write(self.EPD_RST_PIN, 1) 
         time.sleep(0.03) 
@@ -112,12 +142,15 @@ class EPD():
         epdconfig.spi_writebyte2(buf, Len)
 
     def ReadBusyH(self, where, observe_stop_flag=True):
-        logger.debug(f"e-Paper busy H checking at {where}")
+        logger.debug("e-Paper busy H checking at %s", where)
         while(epdconfig.digital_read(self.EPD_BUSY_PIN) == 0):      # 0: busy, 1: idle
-            if observe_stop_flag and self.should_stop:
-                return
-            epdconfig.delay_ms(100)
-        logger.debug(f"e-Paper busy H released at {where}")
+            if observe_stop_flag:
+                # Returns early as soon as a stop is requested
+                if self.stop_event.wait(0.1):
+                    return
+            else:
+                epdconfig.delay_ms(100)
+        logger.debug("e-Paper busy H released at %s", where)
 
     def writePower(self, state, title, stop=True):
         if state == True:
@@ -127,10 +160,10 @@ class EPD():
             name = "off"
             cmd  = 0x02
         else:
-            logger.error(f"Invalid input: {state} for {title}")
+            logger.error("Invalid input: %s for %s", state, title)
             return
 
-        logger.debug(f"Write power {name} starting for {title}") # Power on
+        logger.debug("Write power %s starting for %s", name, title) # Power on
         self.CS_ALL(0)
 #        self.returnFunc(title)
         self.SendCommand(cmd)
@@ -144,22 +177,22 @@ class EPD():
         self.powered_on = state
 
     def writeDRF(self, title):
-        logger.debug(f"Write DRF for {title}") # Display refresh
+        logger.debug("Write DRF for %s", title) # Display refresh
         self.CS_ALL(0)
-        self.returnFunc("1 "+title)
+        self.returnFunc(title, 1)
         self.SendCommand(0x12)
-        self.returnFunc("2 "+title)
+        self.returnFunc(title, 2)
         self.SendData(0x00)
-        self.returnFunc("3 "+title)
+        self.returnFunc(title, 3)
         self.CS_ALL(1)
-        self.returnFunc("4 "+title)
+        self.returnFunc(title, 4)
         self.ReadBusyH(f"Write DRF {title}", True)
-        self.returnFunc("5 "+title)
+        self.returnFunc(title, 5)
 
     def updateDisplay(self, title):
         try:
             if self.powered_on == False:
-                logger.debug(f"POWER ON = {self.powered_on}")
+                logger.debug("POWER ON = %s", self.powered_on)
                 self.writePower(True, title, not self.powered_on)
 
             epdconfig.delay_ms(50)
@@ -167,10 +200,11 @@ class EPD():
             self.writeDRF(title)
 
             self.writePower(False, title)
-            logger.debug(f"Write to display complete for {title}")
+            logger.debug("Write to display complete for %s", title)
+            return True
 
         except EarlyExit:
-            return
+            return False
 
     def Init(self):
         logger.debug("EPD init...")
@@ -285,16 +319,6 @@ class EPD():
         self.CS_ALL(1)
     
     def getbuffer(self, image):
-        # Create a pallette with the 7 colors supported by the panel
-        pal_image = Image.new("P", (1,1))
-        # original
-        pal_image.putpalette( (0,0,0,  255,255,255,  255,255,0,  255,0,0,  0,0,0,  0,0,255,  0,255,0) + (0,0,0)*249)
-        # claude suggests
-        #pal_image.putpalette((25,30,33, 241,241,241, 49,49,143, 83,164,40, 210,14,19, 184,94,28, 243,207,17) + (0,0,0)*249)
-        pal_image.putpalette((0,0,0, 255,255,255, 255,236,35, 209,0,0, 0,0,0, 35,35,255, 0,208,65) + (0,0,0)*249)
-        # not sure?
-        #pal_image.putpalette((0,0,0,  255,255,255,  0,255,0,   0,0,255,  255,0,0,  255,255,0, 255,128,0) + (0,0,0)*249)
-
         # Check if we need to rotate the image
         imwidth, imheight = image.size
         if(imwidth == self.width and imheight == self.height):
@@ -302,77 +326,82 @@ class EPD():
         elif(imwidth == self.height and imheight == self.width):
             image_temp = image.rotate(90, expand=True)
         else:
-            logger.error("Invalid image dimensions: %d x %d, expected %d x %d" % (imwidth, imheight, self.width, self.height))
+            logger.error("Invalid image dimensions: %d x %d, expected %d x %d", imwidth, imheight, self.width, self.height)
 
         # Convert the soruce image to the 7 colors, dithering if needed
-        image_7color = image_temp.convert("RGB").quantize(palette=pal_image)
-        buf_7color = bytearray(image_7color.tobytes('raw'))
+        image_7color = image_temp.convert("RGB").quantize(palette=self.pal_image)
+        buf_7color = np.frombuffer(image_7color.tobytes('raw'), dtype=np.uint8)
 
         # PIL does not support 4 bit color, so pack the 4 bits of color
-        # into a single byte to transfer to the panel
-        buf = [0x00] * int(self.width * self.height / 2)
-        idx = 0
-        for i in range(0, len(buf_7color), 2):
-            buf[idx] = (buf_7color[i] << 4) + buf_7color[i+1]
-            idx += 1
-            
-        return buf
+        # into a single byte to transfer to the panel, a pixel pair at a time.
+        np.left_shift(buf_7color[0::2], 4, out=self.pack_out)
+        np.bitwise_or(self.pack_out, buf_7color[1::2], out=self.pack_out)
+        # Returned as bytes (a copy) so it can be handed between threads and
+        # sliced without copying, while pack_out is reused for the next image
+        return self.pack_out.tobytes()
     
     def Clear(self, color=0x11):
+        # Each half of a row is the same, so build it once
+        Width = self.width // 2
+        row = bytes([color]) * Width
         epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
         self.SendCommand(0x10)
         for i in range(self.height):
-            self.SendData2([color]* int(self.width/2), int(self.width/2))
+            self.SendData2(row, Width)
         self.CS_ALL(1)
         epdconfig.digital_write(self.EPD_CS_S_PIN, 0)
         self.SendCommand(0x10)
         for i in range(self.height):
-            self.SendData2([color]* int(self.width/2), int(self.width/2))
+            self.SendData2(row, Width)
         self.CS_ALL(1)
 
         self.writePower(True, "Clear")
 
-    def returnFunc(self, title):
-        if self.should_stop:
-            logger.info(f"Returning early from [[{getParent()}]] due to should_stop for {title}")
+    # Called between every SPI transfer, so the step is passed separately and
+    # only formatted into the message when actually stopping
+    def returnFunc(self, title, step=None):
+        if self.stop_event.is_set():
+            logger.info("Returning early from [[%s]] step %s due to should_stop for %s", getParent(), step, title)
             epdconfig.digital_write(self.EPD_BUSY_PIN, 1) 
-            self.should_stop = False
+            self.stop_event.clear()
             raise EarlyExit()
 
     def display(self, image, title):
         try:
-            Width  = int(self.width / 4)
-            Width1 = int(self.width / 2)
+            Width  = self.width // 4
+            Width1 = self.width // 2
+            # Slices of a memoryview share the buffer rather than copying each row
+            image = memoryview(image)
 
             self.ReadBusyH(f"Starting [[{getParent()}]] {title}")
-            logger.debug(f"Sending data 1 for {title}")
+            logger.debug("Sending data 1 for %s", title)
             self.CS_ALL(1)
-            self.returnFunc("1 "+title)
+            self.returnFunc(title, 1)
             epdconfig.digital_write(self.EPD_CS_M_PIN, 0)
-            self.returnFunc("2 "+title)
+            self.returnFunc(title, 2)
             self.SendCommand(0x10)
-            self.returnFunc("3 "+title)
+            self.returnFunc(title, 3)
             for i in range(self.height):
                 self.SendData2(image[i * Width1 : i * Width1+Width], Width)
-                self.returnFunc("4 "+title)
+                self.returnFunc(title, 4)
             self.CS_ALL(1)
-            self.returnFunc("5 "+title)
+            self.returnFunc(title, 5)
 
-            logger.debug(f"Sending data 2 for {title}")
+            logger.debug("Sending data 2 for %s", title)
             epdconfig.digital_write(self.EPD_CS_S_PIN, 0)
-            self.returnFunc("6 "+title)
+            self.returnFunc(title, 6)
             self.SendCommand(0x10)
-            self.returnFunc("7 "+title)
+            self.returnFunc(title, 7)
             for i in range(self.height):
                 self.SendData2(image[i * Width1+Width : i * Width1+Width1], Width)
-                self.returnFunc("8 "+title)
+                self.returnFunc(title, 8)
             self.CS_ALL(1)
-            self.returnFunc("9 "+title)
+            self.returnFunc(title, 9)
 
-            self.updateDisplay(title)
+            return self.updateDisplay(title)
 
         except EarlyExit:
-            return
+            return False
 
     def sleep(self):
         self.CS_ALL(0)
@@ -90,7 +90,11 @@ def spi_writebyte(value):
     spi.DEV_SPI_SendData(value)
 
 def spi_writebyte2(buf, len): 
-    array_data = (ctypes.c_ubyte * len)(*buf)
+    if isinstance(buf, list):
+        array_data = (ctypes.c_ubyte * len)(*buf)
+    else:
+        # bytes-like buffers are copied in one go rather than byte by byte
+        array_data = (ctypes.c_ubyte * len).from_buffer_copy(buf)
     spi.DEV_SPI_SendData_nByte(array_data, ctypes.c_ulong(len))
  
 def delay_ms(delaytime):